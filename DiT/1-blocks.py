@@ -58,7 +58,7 @@ def main(args):
     model.load_state_dict(state_dict)
     # Set the model to evaluation mode
     model.eval()  
-    vae = AutoencoderKL.from_pretrained(f"~/GOC/DiT/pretrained_models/sd-vae-ft-ema").to(device)
+    vae = AutoencoderKL.from_pretrained(os.path.expanduser("~/GOC/DiT/pretrained_models/sd-vae-ft-ema")).to(device)
 
     for i in range (1000):
         # Set the random seed
@@ -104,7 +104,7 @@ def main(args):
             hook.remove()
 
         # save block_outputs 
-        save_path = f'~/GOC/learning-to-cache-main/DiT/block_pth/{label}_block_outputs.pth'
+        save_path = os.path.expanduser(f'~/GOC/learning-to-cache-main/DiT/block_pth/{label}_block_outputs.pth')
         torch.save(block_outputs, save_path)
 
         print("every block_outputs have been saved:", save_path)
@@ -2,8 +2,8 @@ import torch
 import os
 
 # Define directory paths
-block_pth_dir = '~/GOC/DiT/block_pth'
-output_dir = '~/GOC/DiT/averaged_pth'
+block_pth_dir = os.path.expanduser('~/GOC/DiT/block_pth')
+output_dir = os.path.expanduser('~/GOC/DiT/averaged_pth')
 # Ensure the save directory exists
 os.makedirs(output_dir, exist_ok=True)  
 
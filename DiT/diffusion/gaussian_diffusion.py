@@ -498,7 +498,7 @@ class GaussianDiffusion:
             indices = tqdm(indices)
 
         for i in indices:
-            t = th.tensor([i] * shape[0], device=device)
+            t = th.full((shape[0],), i, dtype=th.long, device=device)
             with th.no_grad():
                 out = self.p_sample(
                     model,
@@ -681,7 +681,7 @@ class GaussianDiffusion:
         current_step = 0
 
         for i in indices:
-            t = th.tensor([i] * shape[0], device=device)
+            t = th.full((shape[0],), i, dtype=th.long, device=device)
 
             with th.no_grad():
                 out = self.ddim_sample(
@@ -393,7 +393,7 @@ class DiT(nn.Module):
         # eps, rest = model_out[:, :self.in_channels], model_out[:, self.in_channels:]
         eps, rest = model_out[:, :3], model_out[:, 3:]
         cond_eps, uncond_eps = torch.split(eps, len(eps) // 2, dim=0)
-        half_eps = uncond_eps + cfg_scale * (cond_eps - uncond_eps)
+        half_eps = torch.lerp(uncond_eps, cond_eps, cfg_scale)  # uncond + s * (cond - uncond) in one kernel
         eps = torch.cat([half_eps, half_eps], dim=0)
         return torch.cat([eps, rest], dim=1), current_step
 
@@ -53,7 +53,7 @@ def main(args):
     state_dict = find_model(ckpt_path)
     model.load_state_dict(state_dict)
     model.eval()  # important!
-    vae = AutoencoderKL.from_pretrained(f"~/GOC/learning-to-cache-main/DiT/pretrained_models/sd-vae-ft-ema").to(device)
+    vae = AutoencoderKL.from_pretrained(os.path.expanduser("~/GOC/learning-to-cache-main/DiT/pretrained_models/sd-vae-ft-ema")).to(device)
     # vae = AutoencoderKL.from_pretrained(f"stabilityai/sd-vae-ft-{args.vae}").to(device)
 
     torch.manual_seed(args.seed)
@@ -72,7 +72,7 @@ def main(args):
     model_kwargs = dict(y=y, cfg_scale=args.cfg_scale)
 
     # block_outputs = torch.load('/data/qiujx/learning-to-cache-main/DiT/averaged_pth/averaged_block_outputs.pth')
-    block_outputs = torch.load('~/GOC/DiT/averaged_block_outputs.pth')
+    block_outputs = torch.load(os.path.expanduser('~/GOC/DiT/averaged_block_outputs.pth'))
       
     # Sample images:
     import time
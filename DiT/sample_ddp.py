@@ -9,10 +9,12 @@ Samples a large number of images from a pre-trained DiT model using DDP.
 Subsequently saves a .npz file that can be used to compute FID and other
 evaluation metrics via the ADM repo: https://github.com/openai/guided-diffusion/tree/main/evaluations
 
+Launch with torchrun, one process per GPU, e.g.:
+    torchrun --nnodes=1 --nproc_per_node=8 sample_ddp.py --model DiT-XL/2 --ddim-sample ...
+
 For a simple single-GPU/CPU sampling script, see sample.py.
 """
 import os
-os.environ["CUDA_VISIBLE_DEVICES"] = "4"
 import torch
 import torch.distributed as dist
 from download import find_model
@@ -24,33 +26,149 @@ from PIL import Image
 import numpy as np
 import math
 import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Model module for each --accelerate-method. Exact names are checked first, then substrings
+# (e.g. "ranklayer_xx" selects the rankdrop models); anything else uses the original DiT.
+ACCELERATE_MODULES = {
+    "cache": "models.cache_models",
+    "iterate": "models.iterate_models",
+    "nolastlayer": "models.nolastlayer_models",
+    "dynamiclayer": "models.dynamic_models",
+    "layerdropout": "models.layerdropout_models",
+    "dynamiclayer_soft": "models.router_models_inference",
+}
+ACCELERATE_SUBSTRING_MODULES = {
+    "ranklayer": "models.rankdrop_models",
+    "bottomlayer": "models.bottom_models",
+    "randomlayer": "models.randomlayer_models",
+    "fixlayer": "models.fixlayer_models",
+}
+
+
+def get_model_module(accelerate_method):
+    """
+    Returns the import path of the module providing DiT_models for an accelerate method.
+    """
+    if accelerate_method is None:
+        return "models.models"
+    if accelerate_method in ACCELERATE_MODULES:
+        return ACCELERATE_MODULES[accelerate_method]
+    for key, module in ACCELERATE_SUBSTRING_MODULES.items():
+        if key in accelerate_method:
+            return module
+    return "models.models"
 
 
-def create_npz_from_sample_folder(sample_dir, num=50_000):
+def create_npz_from_sample_folder(sample_dir, num=50_000, save_format="png"):
     """
-    Builds a single .npz file from a folder of .png samples.
+    Builds a single .npz file from a folder of .png/.webp samples, or from the samples.npy written with --save-format npy.
     """
-    samples = []
-    for i in tqdm(range(num), desc="Building .npz file from samples"):
-        sample_pil = Image.open(f"{sample_dir}/{i:06d}.png")
-        sample_np = np.asarray(sample_pil).astype(np.uint8)
-        samples.append(sample_np)
-    samples = np.stack(samples)
-    assert samples.shape == (num, samples.shape[1], samples.shape[2], 3)
+    if save_format == "npy":
+        samples = np.load(f"{sample_dir}/samples.npy", mmap_mode="r")[:num]
+    else:
+        h, w = np.asarray(Image.open(f"{sample_dir}/{0:06d}.{save_format}")).shape[:2]
+        samples = np.empty((num, h, w, 3), dtype=np.uint8)
+
+        def load(i):
+            samples[i] = np.asarray(Image.open(f"{sample_dir}/{i:06d}.{save_format}"))
+
+        # PIL releases the GIL while decoding, so threads decode in parallel straight into the preallocated array:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            futures = [pool.submit(load, i) for i in range(num)]
+            for future in tqdm(as_completed(futures), total=num, desc="Building .npz file from samples"):
+                future.result()
     npz_path = f"{sample_dir}.npz"
     np.savez(npz_path, arr_0=samples)
     print(f"Saved .npz file to {npz_path} [shape={samples.shape}].")
     return npz_path
 
 
+def save_sample(sample, path):
+    """
+    Encodes a single HxWx3 uint8 sample and writes it to disk (.webp files are saved losslessly).
+    """
+    if path.endswith(".webp"):
+        # In lossless mode quality/method only set compression effort; use the fastest setting.
+        Image.fromarray(sample).save(path, "WEBP", lossless=True, quality=0, method=0)
+    else:
+        Image.fromarray(sample).save(path)
+
+
+class CachedForward:
+    """
+    Wraps forward_with_cfg and skips full DiT forwards on steps where the timestep embedding has
+    barely moved since the last full forward. Skipped steps reuse the last output, extrapolated
+    to the current step with a first-order (TaylorSeer-style) correction.
+
+    The skip schedule depends only on the timesteps, so it is computed once on the host. Skipped
+    steps do not advance the model's own reuse_feature state, so on the next full forward the older
+    slot is refilled with the newest features: the GOC trend term becomes zero instead of being
+    extrapolated across the gap, and each model still takes the same cache branch.
+    """
+    def __init__(self, model, forward_fn, timesteps, interval, warmup, thres):
+        self.model = model
+        self.forward_fn = forward_fn
+        self.schedule = self.build_schedule(model, timesteps, interval, warmup, thres)
+        self.reset()
+
+    @staticmethod
+    def build_schedule(model, timesteps, interval, warmup, thres):
+        """
+        timesteps: model timesteps in sampling order.
+        interval: a full forward is forced at least every `interval` steps.
+        warmup: the first `warmup` steps are always computed.
+        thres: relative L1 change of the timestep embedding that triggers a full forward.
+        Returns one bool per step, True where the full forward runs.
+        """
+        device = next(model.parameters()).device
+        with torch.no_grad():
+            t_emb = model.t_embedder(torch.tensor(timesteps, device=device)).float()
+            # delta[i, j]: change from the embedding at step j to step i, relative to step j
+            delta = torch.cdist(t_emb, t_emb, p=1) / t_emb.abs().sum(dim=1)[None]
+        delta = delta.cpu().tolist()
+
+        schedule, ref = [], None
+        for step in range(len(timesteps)):
+            compute = step < warmup or ref is None or delta[step][ref] > thres or step - ref >= interval
+            if compute:
+                ref = step
+            schedule.append(compute)
+        return schedule
+
+    def reset(self):
+        self.step = 0
+        self.outputs = []  # (step, output) of the last two full forwards
+
+    def __call__(self, x, t, y, cfg_scale, current_step, block_outputs):
+        if self.schedule[self.step]:
+            if self.outputs and self.outputs[-1][0] != self.step - 1:
+                # Cached block features are more than one step old; zero the trend without emptying the slot,
+                # since the models pick their reuse path (and router lookups) from which slots are filled:
+                for features in self.model.reuse_feature:
+                    if features[1] is not None:
+                        features[1] = features[0]
+            out, current_step = self.forward_fn(x, t, y, cfg_scale, current_step, block_outputs)
+            self.outputs = self.outputs[-1:] + [(self.step, out)]
+        else:
+            last_step, out = self.outputs[-1]
+            if len(self.outputs) == 2:
+                prev_step, prev_out = self.outputs[0]
+                out = out + (out - prev_out) * ((self.step - last_step) / (last_step - prev_step))
+        self.step += 1
+        return out, current_step
+
 
 def main(args):
     """
     Run sampling.
     """
     torch.backends.cuda.matmul.allow_tf32 = args.tf32  # True: fast but may lead to some small numerical differences
+    torch.backends.cudnn.benchmark = True  # VAE decode sees the same input shape every batch
     assert torch.cuda.is_available(), "Sampling with DDP requires at least one GPU. sample.py supports CPU-only usage"
-    torch.set_grad_enabled(False)
+    inference_dtype = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}[args.inference_dtype]
+    use_autocast = inference_dtype != torch.float32
 
     # Setup DDP:
     # dist.init_process_group("nccl")
@@ -65,11 +183,12 @@ def main(args):
 
     dist.init_process_group("nccl")
     rank = dist.get_rank()
-    device = rank % torch.cuda.device_count()
-    seed = args.global_seed * dist.get_world_size() + rank
+    world_size = dist.get_world_size()
+    device = int(os.environ.get("LOCAL_RANK", rank % torch.cuda.device_count()))
+    seed = args.global_seed * world_size + rank
     torch.manual_seed(seed)
     torch.cuda.set_device(device)
-    print(f"Starting rank={rank}, seed={seed}, world_size={dist.get_world_size()}.")
+    print(f"Starting rank={rank}, seed={seed}, world_size={world_size}.")
     
     if args.ckpt is None:
         assert args.model == "DiT-XL/2", "Only DiT-XL/2 models are available for auto-download."
@@ -80,51 +199,41 @@ def main(args):
     
     # Load model:
     latent_size = args.image_size // 8
-    if args.accelerate_method == "cache":
-        from models.cache_models import DiT_models
-    elif args.accelerate_method == "iterate":
-        from models.iterate_models import DiT_models
-    elif args.accelerate_method == "nolastlayer":
-        from models.nolastlayer_models import DiT_models
-    elif args.accelerate_method is not None and "ranklayer" in args.accelerate_method:
-        from models.rankdrop_models import DiT_models
-    elif args.accelerate_method is not None and "bottomlayer" in args.accelerate_method:
-        from models.bottom_models import DiT_models
-    elif args.accelerate_method is not None and "randomlayer" in args.accelerate_method:
-        from models.randomlayer_models import DiT_models
-    elif args.accelerate_method is not None and "fixlayer" in args.accelerate_method:
-        from models.fixlayer_models import DiT_models
-    elif args.accelerate_method is not None and args.accelerate_method == "dynamiclayer":
-        from models.dynamic_models import DiT_models
-    elif args.accelerate_method is not None and args.accelerate_method == "layerdropout":
-        from models.layerdropout_models import DiT_models
-    elif args.accelerate_method is not None and args.accelerate_method == "dynamiclayer_soft":
-        from models.router_models_inference import DiT_models
-    else:
-        from models.models import DiT_models
-
-    model = DiT_models[args.model](
-        input_size=latent_size,
-        num_classes=args.num_classes
-    ).to(device)
-
-    if args.accelerate_method is not None:
-        if 'ranklayer' in args.accelerate_method:
-            model.load_ranking(args.num_sampling_steps, args.accelerate_method)
-        elif 'randomlayer' in args.accelerate_method:
-            model.load_ranking(args.accelerate_method)
-        elif 'bottomlayer' in args.accelerate_method or 'fixlayer' in args.accelerate_method:
-            model.load_ranking(args.accelerate_method)
-        elif 'dynamiclayer' in args.accelerate_method or 'layerdropout' in args.accelerate_method or 'dynamiclayer_soft' in args.accelerate_method:
-            model.load_ranking(args.path, args.num_sampling_steps, diffusion.timestep_map, args.thres)
-    
-    
-    # Auto-download a pre-trained model or load a custom DiT checkpoint from train.py:
-    ckpt_path = args.ckpt or f"DiT-XL-2-{args.image_size}x{args.image_size}.pt"
-    state_dict = find_model(ckpt_path)
-    model.load_state_dict(state_dict)
-    model.eval()  # important!
-    vae = AutoencoderKL.from_pretrained(f"~/GOC/DiT/pretrained_models/sd-vae-ft-ema").to(device)
+    DiT_models = importlib.import_module(get_model_module(args.accelerate_method)).DiT_models
+
+    # Router evaluation in load_ranking runs modules too; keep loading out of autograd:
+    with torch.no_grad():
+        model = DiT_models[args.model](
+            input_size=latent_size,
+            num_classes=args.num_classes
+        ).to(device)
+
+        if args.accelerate_method is not None:
+            if 'ranklayer' in args.accelerate_method:
+                model.load_ranking(args.num_sampling_steps, args.accelerate_method)
+            elif 'randomlayer' in args.accelerate_method:
+                model.load_ranking(args.accelerate_method)
+            elif 'bottomlayer' in args.accelerate_method or 'fixlayer' in args.accelerate_method:
+                model.load_ranking(args.accelerate_method)
+            elif 'dynamiclayer' in args.accelerate_method or 'layerdropout' in args.accelerate_method or 'dynamiclayer_soft' in args.accelerate_method:
+                model.load_ranking(args.path, args.num_sampling_steps, diffusion.timestep_map, args.thres)
+
+
+        # Auto-download a pre-trained model or load a custom DiT checkpoint from train.py:
+        ckpt_path = args.ckpt or f"DiT-XL-2-{args.image_size}x{args.image_size}.pt"
+        state_dict = find_model(ckpt_path)
+        model.load_state_dict(state_dict)
+        model.eval()  # important!
+        vae = AutoencoderKL.from_pretrained(os.path.expanduser("~/GOC/DiT/pretrained_models/sd-vae-ft-ema")).to(device)
+        vae = vae.to(memory_format=torch.channels_last)  # lets cuDNN pick NHWC conv kernels for decoding
+    if args.compile_mode is not None:
+        # Only the stateless per-block compute is compiled. DiT.forward keeps cached features across steps
+        # and branches on the Python step index, which would force a recompile for every step:
+        for block in model.blocks:
+            block.attn = torch.compile(block.attn, mode=args.compile_mode)
+            block.mlp = torch.compile(block.mlp, mode=args.compile_mode)
+            block.adaLN_modulation = torch.compile(block.adaLN_modulation, mode=args.compile_mode)
+        vae.decode = torch.compile(vae.decode, mode=args.compile_mode)
     assert args.cfg_scale >= 1.0, "In almost all cases, cfg_scale be >= 1.0"
     using_cfg = args.cfg_scale > 1.0
 
@@ -143,102 +252,200 @@ def main(args):
     os.makedirs(f"{args.sample_dir}", exist_ok=True)
     if rank == 0 and args.save_to_disk:
         os.makedirs(sample_folder_dir, exist_ok=True)
-        print(f"Saving .png samples at {sample_folder_dir}")
+        print(f"Saving .{args.save_format} samples at {sample_folder_dir}")
     dist.barrier()
 
     # Figure out how many samples we need to generate on each GPU and how many iterations we need to run:
     n = args.per_proc_batch_size
-    global_batch_size = n * dist.get_world_size()
+    global_batch_size = n * world_size
     # To make things evenly-divisible, we'll sample a bit more than we need and then discard the extra samples:
     total_samples = int(math.ceil(args.num_fid_samples / global_batch_size) * global_batch_size)
     if rank == 0:
         print(f"Total number of images that will be sampled: {total_samples}")
-        all_images = []
+        if not args.save_to_disk:
+            # Gathered batches are copied straight into their final slots (no per-batch list + concatenate):
+            all_images = np.empty((total_samples, args.image_size, args.image_size, 3), dtype=np.uint8)
+            write_ptr = 0
 
-    assert total_samples % dist.get_world_size() == 0, "total_samples must be divisible by world_size"
-    samples_needed_this_gpu = int(total_samples // dist.get_world_size())
+    assert total_samples % world_size == 0, "total_samples must be divisible by world_size"
+    samples_needed_this_gpu = int(total_samples // world_size)
     assert samples_needed_this_gpu % n == 0, "samples_needed_this_gpu must be divisible by the per-GPU batch size"
     iterations = int(samples_needed_this_gpu // n)
     pbar = range(iterations)
     pbar = tqdm(pbar) if rank == 0 else pbar
     total = 0
+
+    # With --save-format npy every rank writes raw uint8 samples into its slots of one shared .npy memmap:
+    samples_npy = None
+    if args.save_to_disk and args.save_format == "npy":
+        # Rows of different ranks share pages of the file, which is only safe through one host's page cache:
+        assert int(os.environ.get("LOCAL_WORLD_SIZE", world_size)) == world_size, \
+            "--save-format npy writes one shared memmap and requires a single-node run"
+        npy_path = f"{sample_folder_dir}/samples.npy"
+        npy_shape = (total_samples, args.image_size, args.image_size, 3)
+        if rank == 0:
+            np.lib.format.open_memmap(npy_path, mode="w+", dtype=np.uint8, shape=npy_shape).flush()
+        dist.barrier()
+        samples_npy = np.lib.format.open_memmap(npy_path, mode="r+")
     
     current_step = 0
-    
-    for _ in pbar:
-        # model.reset(args.num_sampling_steps)
-        model.reset()
-        
-        # Sample inputs:
-        z = torch.randn(n, model.in_channels, latent_size, latent_size, device=device)
-        y = torch.randint(0, args.num_classes, (n,), device=device)
-        
-
-        # Setup classifier-free guidance:
-        if using_cfg:
-            z = torch.cat([z, z], 0)
-            y_null = torch.tensor([1000] * n, device=device)
-            y = torch.cat([y, y_null], 0)
-            model_kwargs = dict(y=y, cfg_scale=args.cfg_scale)
-            sample_fn = model.forward_with_cfg
-        else:
-            model_kwargs = dict(y=y)
-            sample_fn = model.forward
 
-        # block_outputs = torch.load('~/GOC/DiT/averaged_pth/averaged_block_outputs.pth')
-        block_outputs = torch.load('~/GOC/DiT/averaged_block_outputs.pth')
+    # Load the averaged block outputs once; they are identical for every batch:
+    # block_outputs = torch.load('~/GOC/DiT/averaged_pth/averaged_block_outputs.pth')
+    block_outputs = torch.load(os.path.expanduser('~/GOC/DiT/averaged_block_outputs.pth'), map_location=f"cuda:{device}")
+
+    # Loop-invariant lookup, hoisted out of the per-batch code:
+    in_channels = model.in_channels
+
+    # Null-class labels for classifier-free guidance are the same for every batch:
+    y_null = torch.full((n,), args.num_classes, dtype=torch.long, device=device)
+
+    # Warm up the compiled graphs on one batch so compilation time isn't measured against the first sample.
+    # The RNG is forked so the warmup doesn't shift the seeded noise of the real samples:
+    if args.compile_mode is not None:
+        with torch.inference_mode(), torch.random.fork_rng(devices=[device]):
+            model.reset()
+            z = torch.randn(n, in_channels, latent_size, latent_size, device=device)
+            y = torch.randint(0, args.num_classes, (n,), device=device)
+            if using_cfg:
+                z = torch.cat([z, z], 0)
+                y = torch.cat([y, y_null], 0)
+                model_kwargs = dict(y=y, cfg_scale=args.cfg_scale)
+                sample_fn = model.forward_with_cfg
+            else:
+                model_kwargs = dict(y=y)
+                sample_fn = model.forward
+            with torch.autocast("cuda", dtype=inference_dtype, enabled=use_autocast):
+                if args.p_sample:
+                    samples = diffusion.p_sample_loop(
+                        sample_fn, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=False, device=device
+                    )
+                else:
+                    samples = diffusion.ddim_sample_loop(
+                        model.forward_with_cfg, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs,
+                        progress=False, device=device, block_outputs=block_outputs
+                    )
+                vae.decode((samples[:n] / 0.18215).to(memory_format=torch.channels_last))
+
+    # Output caching across DDIM steps; the skip schedule is shared by all batches:
+    cached_forward = None
+    if args.cache_thres > 0:
+        assert args.ddim_sample and not args.p_sample, "--cache-thres is only supported with --ddim-sample"
+        cached_forward = CachedForward(
+            model, model.forward_with_cfg, diffusion.timestep_map[::-1], args.cache_interval, args.cache_warmup, args.cache_thres
+        )
+
+    # Encode and write image files in the background so the next batch can start sampling right away:
+    saver = ThreadPoolExecutor(max_workers=8) if args.save_to_disk and samples_npy is None else None
+    pending_saves = []
+
+    # Pinned host buffer for device-to-host copies of each (gathered) batch:
+    staging = None
+    if args.save_to_disk or rank == 0:
+        staging_rows = n if args.save_to_disk else global_batch_size
+        staging = torch.empty((staging_rows, args.image_size, args.image_size, 3), dtype=torch.uint8, pin_memory=True)
+
+    # Only rank 0 keeps gathered samples, so only it holds a receive buffer (every rank's batch, in rank order):
+    gather_buf, gather_list = None, None
+    if not args.save_to_disk and rank == 0:
+        gather_buf = torch.empty((global_batch_size, args.image_size, args.image_size, 3), dtype=torch.uint8, device=device)
+        gather_list = list(gather_buf.chunk(world_size, dim=0))
+
+    with torch.inference_mode():
+        for _ in pbar:
+            # model.reset(args.num_sampling_steps)
+            model.reset()
         
-        # Sample images:
-        if args.p_sample:
-            samples = diffusion.p_sample_loop(
-                sample_fn, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=False, device=device
-            )
-        elif args.ddim_sample:
-            # samples = diffusion.ddim_sample_loop(
-            #     sample_fn, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=False, device=device
-            # )
-            # samples = diffusion.ddim_sample_loop(
-            #     sample_fn, z.shape, z, current_step, clip_denoised=False, model_kwargs=model_kwargs, progress=True, device=device
-            # )
-            samples = diffusion.ddim_sample_loop(
-                model.forward_with_cfg, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=True, device=device, block_outputs=block_outputs
-            )
-        else:
-            raise NotImplementedError
+            # Sample inputs:
+            z = torch.randn(n, in_channels, latent_size, latent_size, device=device)
+            y = torch.randint(0, args.num_classes, (n,), device=device)
         
-        if using_cfg:
-            samples, _ = samples.chunk(2, dim=0)  # Remove null class samples
-
-        samples = vae.decode(samples / 0.18215).sample
-        samples = torch.clamp(127.5 * samples + 128.0, 0, 255).permute(0, 2, 3, 1).to(dtype=torch.uint8)
-
-        # Save samples to disk as individual .png files
-        if args.save_to_disk:
-            for i, sample in enumerate(samples):
-                index = i * dist.get_world_size() + rank + total
-                sample = sample.cpu().numpy()
-                Image.fromarray(sample).save(f"{sample_folder_dir}/{index:06d}.png")
-        else:
-            samples = samples.contiguous()
-            gathered_samples = [torch.zeros_like(samples) for _ in range(dist.get_world_size())]
-            dist.all_gather(gathered_samples, samples) 
-
-            if rank == 0:
-                all_images.extend([sample.cpu().numpy() for sample in gathered_samples])
-        total += global_batch_size
 
-        dist.barrier()
+            # Setup classifier-free guidance:
+            if using_cfg:
+                z = torch.cat([z, z], 0)
+                y = torch.cat([y, y_null], 0)
+                model_kwargs = dict(y=y, cfg_scale=args.cfg_scale)
+                sample_fn = model.forward_with_cfg
+            else:
+                model_kwargs = dict(y=y)
+                sample_fn = model.forward
+            ddim_fn = model.forward_with_cfg
+            if cached_forward is not None:
+                cached_forward.reset()
+                ddim_fn = cached_forward
+
+            # Sample images (matmuls and convs run in the requested inference dtype):
+            with torch.autocast("cuda", dtype=inference_dtype, enabled=use_autocast):
+                if args.p_sample:
+                    samples = diffusion.p_sample_loop(
+                        sample_fn, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=False, device=device
+                    )
+                elif args.ddim_sample:
+                    # samples = diffusion.ddim_sample_loop(
+                    #     sample_fn, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=False, device=device
+                    # )
+                    # samples = diffusion.ddim_sample_loop(
+                    #     sample_fn, z.shape, z, current_step, clip_denoised=False, model_kwargs=model_kwargs, progress=True, device=device
+                    # )
+                    samples = diffusion.ddim_sample_loop(
+                        ddim_fn, z.shape, z, clip_denoised=False, model_kwargs=model_kwargs, progress=True, device=device, block_outputs=block_outputs
+                    )
+                else:
+                    raise NotImplementedError
+
+                if using_cfg:
+                    samples, _ = samples.chunk(2, dim=0)  # Remove null class samples
+
+                samples = vae.decode((samples / 0.18215).to(memory_format=torch.channels_last)).sample
+            # Promote back to fp32 so the clamp/quantization matches full-precision sampling. Scaling is done
+            # in place and the uint8 cast happens before the permute; since the decoder output is channels_last,
+            # the permuted NHWC view is already contiguous and no transpose copy is made:
+            samples = samples.float().mul_(127.5).add_(128.0).clamp_(0, 255).to(dtype=torch.uint8).permute(0, 2, 3, 1)
+
+            # Save samples to disk as individual image files, or into the shared .npy
+            if args.save_to_disk:
+                # Keep at most one batch in flight (bounds host memory) and surface any write errors:
+                for future in pending_saves:
+                    future.result()
+                pending_saves = []
+                staging.copy_(samples, non_blocking=True)
+                torch.cuda.current_stream().synchronize()
+                if samples_npy is not None:
+                    # Sample i of this rank goes to index i * world_size + rank + total, as for image files:
+                    samples_npy[total + rank:total + global_batch_size:world_size] = staging.numpy()
+                else:
+                    for i, sample in enumerate(staging.numpy()):
+                        index = i * world_size + rank + total
+                        pending_saves.append(saver.submit(save_sample, sample, f"{sample_folder_dir}/{index:06d}.{args.save_format}"))
+            else:
+                samples = samples.contiguous()
+                dist.gather(samples, gather_list=gather_list, dst=0)
+
+                if rank == 0:
+                    staging.copy_(gather_buf, non_blocking=True)
+                    torch.cuda.current_stream().synchronize()
+                    all_images[write_ptr:write_ptr + len(staging)] = staging.numpy()
+                    write_ptr += len(staging)
+            total += global_batch_size
+
+    if saver is not None:
+        for future in pending_saves:
+            future.result()
+        saver.shutdown(wait=True)
+    if samples_npy is not None:
+        samples_npy.flush()
+        del samples_npy
 
     # Make sure all processes have finished saving their samples before attempting to convert to .npz
     dist.barrier()
     if rank == 0:
         if args.save_to_disk:
-            create_npz_from_sample_folder(sample_folder_dir, args.num_fid_samples)
+            create_npz_from_sample_folder(sample_folder_dir, args.num_fid_samples, args.save_format)
             print("Done.")
         else:
             if rank == 0:
-                arr = np.concatenate(all_images, axis=0)
-                arr = arr[: args.num_fid_samples]
+                arr = all_images[: args.num_fid_samples]
 
                 out_path =  f"{sample_folder_dir}.npz"
 
@@ -276,6 +483,20 @@ if __name__ == "__main__":
     parser.add_argument("--path", type=str, default=None,)
 
     parser.add_argument("--save-to-disk", action="store_true", default=False,)
+    parser.add_argument("--save-format", type=str, choices=["png", "webp", "npy"], default="png",
+                        help="File format used with --save-to-disk. npy skips image encoding and writes one memory-mapped samples.npy.")
+    parser.add_argument("--compile-mode", type=str, default=None,
+                        choices=["default", "max-autotune-no-cudagraphs"],
+                        help="Optional torch.compile mode for the DiT block compute and VAE decoder (default: no compilation). "
+                             "CUDA-graph modes are not offered: cached features are carried across steps and would be overwritten on replay.")
+    parser.add_argument("--inference-dtype", type=str, choices=["fp32", "fp16", "bf16"], default="fp32",
+                        help="Autocast dtype for the DiT forward and VAE decode. fp16/bf16 use tensor cores on Ampere+ GPUs.")
+    parser.add_argument("--cache-thres", type=float, default=0.0,
+                        help="Reuse the previous DDIM step output while the relative timestep-embedding change stays below this (0: disabled).")
+    parser.add_argument("--cache-interval", type=int, default=3,
+                        help="Force a full forward at least every N steps when --cache-thres is set.")
+    parser.add_argument("--cache-warmup", type=int, default=3,
+                        help="Number of initial steps that always run a full forward when --cache-thres is set.")
     # parser.add_argument("--device", type=int, default=7, help="CUDA device to use (default: 0)")
 
     args = parser.parse_args()